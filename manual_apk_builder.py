@@ -13,10 +13,15 @@ we build the manifest by hand following the Android binary XML specification.
 from __future__ import annotations
 
 import argparse
+import array
+import functools
 import hashlib
+import io
+import shutil
 import struct
 import subprocess
-import tempfile
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from zipfile import ZipFile, ZIP_DEFLATED
 
@@ -30,54 +35,140 @@ RES_XML_START_ELEMENT_TYPE = 0x0102
 RES_XML_END_ELEMENT_TYPE = 0x0103
 DATA_TYPE_STRING = 0x03
 ANDROID_NAME_RESOURCE_ID = 0x01010003
+NO_INDEX = 0xFFFFFFFF
+NAMESPACE_CHUNK_SIZE = 0x18
+START_ELEMENT_HEADER_SIZE = 0x24
+ATTRIBUTE_SIZE = 0x14
+END_ELEMENT_CHUNK_SIZE = 0x18
+# classes.dex barely shrinks under heavier deflate, so favour build speed
+APK_COMPRESS_LEVEL = 1
+# keytool/jarsigner/apksigner are short-lived JVMs: skip C2 compilation and
+# use the serial collector to trim startup time. The JDK tools forward -J<opt>
+# verbatim, while the build-tools apksigner wrapper prepends the dash itself.
+JVM_STARTUP_FLAGS = [
+    "-J-XX:TieredStopAtLevel=1",
+    "-J-XX:+UseSerialGC",
+]
+APKSIGNER_JVM_FLAGS = [
+    "-JXX:TieredStopAtLevel=1",
+    "-JXX:+UseSerialGC",
+]
 
+# Precompiled chunk layouts, reused for every chunk of the same shape
+_HEADER_STRUCT = struct.Struct("<HHI")
+_STRING_POOL_HEADER = struct.Struct("<HHIIIIII")
+_NODE_STRUCT = struct.Struct("<HHIIIII")
+_START_ELEM_HEADER = struct.Struct("<HHIIIIIHHHHHH")
+_ATTR_STRUCT = struct.Struct("<IIIHBBI")
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+
+MANIFEST_STRINGS = [
+    "manifest",
+    ANDROID_NS,
+    "android",
+    "package",
+    "application",
+    "activity",
+    "intent-filter",
+    "action",
+    "category",
+    "name",
+    "com.tencent.mm",
+    "com.tencent.mm.ui.MainTabUI",
+    "android.intent.action.MAIN",
+    "android.intent.category.LAUNCHER",
+]
+
+# Document order of the manifest elements: (kind, namespace, name, attributes),
+# where each attribute is (namespace, name, string value)
+MANIFEST_ELEMENTS = [
+    ("start", None, "manifest", [(None, "package", "com.tencent.mm")]),
+    ("start", None, "application", []),
+    ("start", ANDROID_NS, "activity", [(ANDROID_NS, "name", "com.tencent.mm.ui.MainTabUI")]),
+    ("start", None, "intent-filter", []),
+    ("start", ANDROID_NS, "action", [(ANDROID_NS, "name", "android.intent.action.MAIN")]),
+    ("end", ANDROID_NS, "action", []),
+    ("start", ANDROID_NS, "category", [(ANDROID_NS, "name", "android.intent.category.LAUNCHER")]),
+    ("end", ANDROID_NS, "category", []),
+    ("end", None, "intent-filter", []),
+    ("end", ANDROID_NS, "activity", []),
+    ("end", None, "application", []),
+    ("end", None, "manifest", []),
+]
+
+@functools.cache
 def encode_length(value: int) -> bytes:
-    """Encode a string length using the variable-length format used by AXML."""
+    """Encode a string length using the variable-length format used by AXML.
+
+    Encodings are memoized, so the table only grows to the lengths actually seen.
+    """
     if value < 0 or value > 0x3FFF:
         raise ValueError("value out of range for 1- or 2-byte encoding")
     if value <= 0x7F:
-        return bytes([value])
-    return bytes([(value & 0x7F) | 0x80, value >> 7])
+        return bytes((value,))
+    return bytes(((value & 0x7F) | 0x80, value >> 7))
+
+def pack_u32_array(values: list[int]) -> bytes:
+    """Pack a list of integers as consecutive little-endian uint32 values."""
+    if sys.byteorder == "little" and array.array("I").itemsize == 4:
+        return array.array("I", values).tobytes()
+    return struct.pack(f"<{len(values)}I", *values)
 
 def build_string_pool(strings: list[str]) -> tuple[bytes, dict[str, int]]:
     header_size = 28
     flags_utf8 = 0x00000100
     offsets: list[int] = []
-    body = bytearray()
+    fragments: list[bytes] = []
+    cursor = 0
     for text in strings:
-        encoded = text.encode("utf-8")
-        offsets.append(len(body))
-        body += encode_length(len(text))
-        body += encode_length(len(encoded))
-        body += encoded + b"\x00"
-    while len(body) % 4:
-        body += b"\x00"
+        if text.isascii():
+            # Character and byte counts coincide, so one prefix serves both
+            encoded = text.encode("ascii")
+            prefix = encode_length(len(encoded)) * 2
+        else:
+            encoded = text.encode("utf-8")
+            prefix = encode_length(len(text)) + encode_length(len(encoded))
+        offsets.append(cursor)
+        fragments.append(prefix)
+        fragments.append(encoded + b"\x00")
+        cursor += len(prefix) + len(encoded) + 1
+    fragments.append(b"\x00" * (-cursor % 4))
+    body = b"".join(fragments)
     strings_start = header_size + len(strings) * 4
     chunk_size = strings_start + len(body)
-    header = struct.pack("<HHI", RES_STRING_POOL_TYPE, header_size, chunk_size)
-    chunk = bytearray(header)
-    chunk += struct.pack("<IIIII", len(strings), 0, flags_utf8, strings_start, 0)
-    for offset in offsets:
-        chunk += struct.pack("<I", offset)
-    chunk += body
+    parts = [
+        _STRING_POOL_HEADER.pack(
+            RES_STRING_POOL_TYPE,
+            header_size,
+            chunk_size,
+            len(strings),
+            0,
+            flags_utf8,
+            strings_start,
+            0,
+        ),
+        pack_u32_array(offsets),
+        body,
+    ]
     mapping = {text: index for index, text in enumerate(strings)}
-    return bytes(chunk), mapping
+    return b"".join(parts), mapping
 
 def build_resource_map(resource_ids: list[int]) -> bytes:
     header_size = 8
     chunk_size = header_size + 4 * len(resource_ids)
-    chunk = struct.pack("<HHI", RES_XML_RESOURCE_MAP_TYPE, header_size, chunk_size)
-    for res_id in resource_ids:
-        chunk += struct.pack("<I", res_id)
-    return chunk
+    header = _HEADER_STRUCT.pack(RES_XML_RESOURCE_MAP_TYPE, header_size, chunk_size)
+    return header + pack_u32_array(resource_ids)
 
 def namespace_chunk(chunk_type: int, prefix_index: int, uri_index: int) -> bytes:
-    header_size = 0x18
-    chunk_size = header_size
-    return (
-        struct.pack("<HHI", chunk_type, header_size, chunk_size)
-        + struct.pack("<II", 0, 0)
-        + struct.pack("<II", prefix_index, uri_index)
+    return _NODE_STRUCT.pack(
+        chunk_type,
+        NAMESPACE_CHUNK_SIZE,
+        NAMESPACE_CHUNK_SIZE,
+        0,
+        0,
+        prefix_index,
+        uri_index,
     )
 
 def start_element_chunk(
@@ -85,126 +176,120 @@ def start_element_chunk(
     name_index: int,
     attributes: list[tuple[int | None, int, int, tuple[int, int]]],
 ) -> bytes:
-    header_size = 0x24
-    attribute_size = 0x14
-    chunk_size = header_size + attribute_size * len(attributes)
-    chunk = bytearray()
-    chunk += struct.pack("<HHI", RES_XML_START_ELEMENT_TYPE, header_size, chunk_size)
-    chunk += struct.pack("<II", 0, 0)
-    chunk += struct.pack("<II", ns_index if ns_index is not None else 0xFFFFFFFF, name_index)
-    chunk += struct.pack("<HHHHHH", 0x14, 0x14, len(attributes), 0, 0, 0)
+    chunk_size = START_ELEMENT_HEADER_SIZE + ATTRIBUTE_SIZE * len(attributes)
+    parts = [
+        _START_ELEM_HEADER.pack(
+            RES_XML_START_ELEMENT_TYPE,
+            START_ELEMENT_HEADER_SIZE,
+            chunk_size,
+            0,
+            0,
+            ns_index if ns_index is not None else NO_INDEX,
+            name_index,
+            0x14,
+            0x14,
+            len(attributes),
+            0,
+            0,
+            0,
+        )
+    ]
     for attr_ns, attr_name, raw_index, (data_type, data_value) in attributes:
-        chunk += struct.pack("<I", attr_ns if attr_ns is not None else 0xFFFFFFFF)
-        chunk += struct.pack("<I", attr_name)
-        chunk += struct.pack("<I", raw_index if raw_index is not None else 0xFFFFFFFF)
-        chunk += struct.pack("<HBBI", 8, 0, data_type, data_value)
-    return bytes(chunk)
+        parts.append(
+            _ATTR_STRUCT.pack(
+                attr_ns if attr_ns is not None else NO_INDEX,
+                attr_name,
+                raw_index if raw_index is not None else NO_INDEX,
+                8,
+                0,
+                data_type,
+                data_value,
+            )
+        )
+    return b"".join(parts)
 
 def end_element_chunk(ns_index: int | None, name_index: int) -> bytes:
-    header_size = 0x18
-    chunk_size = header_size
-    return (
-        struct.pack("<HHI", RES_XML_END_ELEMENT_TYPE, header_size, chunk_size)
-        + struct.pack("<II", 0, 0)
-        + struct.pack("<II", ns_index if ns_index is not None else 0xFFFFFFFF, name_index)
+    return _NODE_STRUCT.pack(
+        RES_XML_END_ELEMENT_TYPE,
+        END_ELEMENT_CHUNK_SIZE,
+        END_ELEMENT_CHUNK_SIZE,
+        0,
+        0,
+        ns_index if ns_index is not None else NO_INDEX,
+        name_index,
     )
 
-def build_manifest() -> bytes:
-    strings = [
-        "manifest",
-        "http://schemas.android.com/apk/res/android",
-        "android",
-        "package",
-        "application",
-        "activity",
-        "intent-filter",
-        "action",
-        "category",
-        "name",
-        "com.tencent.mm",
-        "com.tencent.mm.ui.MainTabUI",
-        "android.intent.action.MAIN",
-        "android.intent.category.LAUNCHER",
-    ]
+def compile_manifest(
+    strings: list[str],
+    elements: list[tuple[str, str | None, str, list[tuple[str | None, str, str]]]],
+) -> bytes:
+    """Emit an element table shaped like MANIFEST_ELEMENTS as an AXML document.
+
+    Every namespace, name and attribute value it references must be in strings.
+    """
     string_pool, indexes = build_string_pool(strings)
     res_map = build_resource_map([ANDROID_NAME_RESOURCE_ID])
-    ns_uri = indexes["http://schemas.android.com/apk/res/android"]
+    ns_uri = indexes[ANDROID_NS]
     ns_prefix = indexes["android"]
+
+    def index_of(text: str | None) -> int | None:
+        return None if text is None else indexes[text]
+
     manifest = [string_pool, res_map]
     manifest.append(namespace_chunk(RES_XML_START_NAMESPACE_TYPE, ns_prefix, ns_uri))
-    manifest.append(
-        start_element_chunk(
-            None,
-            indexes["manifest"],
-            [
-                (
-                    None,
-                    indexes["package"],
-                    indexes["com.tencent.mm"],
-                    (DATA_TYPE_STRING, indexes["com.tencent.mm"]),
-                )
-            ],
-        )
-    )
-    manifest.append(start_element_chunk(None, indexes["application"], []))
-    manifest.append(
-        start_element_chunk(
-            ns_uri,
-            indexes["activity"],
-            [
-                (
-                    ns_uri,
-                    indexes["name"],
-                    indexes["com.tencent.mm.ui.MainTabUI"],
-                    (DATA_TYPE_STRING, indexes["com.tencent.mm.ui.MainTabUI"]),
-                )
-            ],
-        )
-    )
-    manifest.append(start_element_chunk(None, indexes["intent-filter"], []))
-    manifest.append(
-        start_element_chunk(
-            ns_uri,
-            indexes["action"],
-            [
-                (
-                    ns_uri,
-                    indexes["name"],
-                    indexes["android.intent.action.MAIN"],
-                    (DATA_TYPE_STRING, indexes["android.intent.action.MAIN"]),
-                )
-            ],
-        )
-    )
-    manifest.append(end_element_chunk(ns_uri, indexes["action"]))
-    manifest.append(
-        start_element_chunk(
-            ns_uri,
-            indexes["category"],
-            [
-                (
-                    ns_uri,
-                    indexes["name"],
-                    indexes["android.intent.category.LAUNCHER"],
-                    (DATA_TYPE_STRING, indexes["android.intent.category.LAUNCHER"]),
-                )
-            ],
-        )
-    )
-    manifest.append(end_element_chunk(ns_uri, indexes["category"]))
-    manifest.append(end_element_chunk(None, indexes["intent-filter"]))
-    manifest.append(end_element_chunk(ns_uri, indexes["activity"]))
-    manifest.append(end_element_chunk(None, indexes["application"]))
-    manifest.append(end_element_chunk(None, indexes["manifest"]))
+    for kind, ns, name, attributes in elements:
+        if kind == "end":
+            manifest.append(end_element_chunk(index_of(ns), indexes[name]))
+            continue
+        resolved = [
+            (
+                index_of(attr_ns),
+                indexes[attr_name],
+                indexes[value],
+                (DATA_TYPE_STRING, indexes[value]),
+            )
+            for attr_ns, attr_name, value in attributes
+        ]
+        manifest.append(start_element_chunk(index_of(ns), indexes[name], resolved))
     manifest.append(namespace_chunk(RES_XML_END_NAMESPACE_TYPE, ns_prefix, ns_uri))
     payload = b"".join(manifest)
-    header = struct.pack("<HHI", RES_XML_TYPE, 8, len(payload) + 8)
+    header = _HEADER_STRUCT.pack(RES_XML_TYPE, 8, len(payload) + 8)
     return header + payload
 
+@functools.cache
+def build_manifest() -> bytes:
+    """Return the compiled AXML manifest; the result is fixed and built once."""
+    return compile_manifest(MANIFEST_STRINGS, MANIFEST_ELEMENTS)
+
 def sign_apk(apk_path: Path, keystore: Path, alias: str = "androiddebugkey") -> None:
+    """Sign with apksigner when available, else fall back to jarsigner.
+
+    The manifest declares no minSdkVersion, so apksigner targets API 1 and
+    writes the v1 (JAR) signature alongside the v2 block.
+    """
+    if shutil.which("apksigner"):
+        subprocess.run(
+            [
+                "apksigner",
+                *APKSIGNER_JVM_FLAGS,
+                "sign",
+                "--ks",
+                str(keystore),
+                "--ks-pass",
+                "pass:android",
+                "--key-pass",
+                "pass:android",
+                "--ks-key-alias",
+                alias,
+                str(apk_path),
+            ],
+            check=True,
+        )
+        return
     subprocess.run(
         [
             "jarsigner",
+            *JVM_STARTUP_FLAGS,
             "-keystore",
             str(keystore),
             "-storepass",
@@ -223,6 +308,7 @@ def ensure_debug_keystore(keystore: Path) -> None:
     subprocess.run(
         [
             "keytool",
+            *JVM_STARTUP_FLAGS,
             "-genkeypair",
             "-v",
             "-keystore",
@@ -245,17 +331,21 @@ def ensure_debug_keystore(keystore: Path) -> None:
         check=True,
     )
 
-def build_apk(output: Path, dex_path: Path) -> None:
+def build_apk(output: Path, dex_path: Path, print_hash: bool = False) -> None:
     manifest_bytes = build_manifest()
-    with tempfile.TemporaryDirectory() as tmp:
-        tmp_dir = Path(tmp)
-        manifest_path = tmp_dir / "AndroidManifest.xml"
-        manifest_path.write_bytes(manifest_bytes)
-        with ZipFile(output, "w", ZIP_DEFLATED) as zf:
-            zf.write(manifest_path, arcname="AndroidManifest.xml")
-            zf.write(dex_path, arcname="classes.dex")
-    checksum = hashlib.sha256(output.read_bytes()).hexdigest()
-    print(f"Created {output} (sha256 {checksum})")
+    # Assemble in memory so the archive hits disk in one write and, if asked,
+    # can be hashed without reading it back
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w", ZIP_DEFLATED, compresslevel=APK_COMPRESS_LEVEL) as zf:
+        zf.writestr("AndroidManifest.xml", manifest_bytes)
+        zf.write(dex_path, arcname="classes.dex")
+    data = buffer.getbuffer()
+    output.write_bytes(data)
+    if print_hash:
+        checksum = hashlib.sha256(data).hexdigest()
+        print(f"Created {output} (sha256 {checksum})")
+    else:
+        print(f"Created {output}")
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Build a debug APK from classes.dex")
@@ -277,12 +367,20 @@ def main() -> None:
         type=Path,
         help="Debug keystore used for signing (created if missing)",
     )
+    parser.add_argument(
+        "--print-hash",
+        action="store_true",
+        help="Print the SHA-256 of the unsigned APK",
+    )
     args = parser.parse_args()
 
     if not args.dex.exists():
         raise SystemExit(f"Dex payload not found: {args.dex}")
-    build_apk(args.output, args.dex)
-    ensure_debug_keystore(args.keystore)
+    # keytool can take a few seconds on first run; overlap it with packaging
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        keystore_ready = executor.submit(ensure_debug_keystore, args.keystore)
+        build_apk(args.output, args.dex, print_hash=args.print_hash)
+        keystore_ready.result()
     sign_apk(args.output, args.keystore)
     print(f"Signed APK written to {args.output}")
 